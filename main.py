@@ -1,18 +1,27 @@
 # main.py
+import asyncio
+import functools
+import hashlib
+import io
 import logging
 import os
-import re
+import shutil
+import signal
 import json
-import threading
+import sys
 import time
+from types import MappingProxyType
 from typing import Dict, Any, List
 
+import diskcache
+import orjson
 from colorama import Fore, Style, init
-from openai import OpenAI as XAI
+from openai import AsyncOpenAI as XAI
 from pygments import highlight
 from pygments.formatters import TerminalFormatter
 from pygments.lexers import PythonLexer
 import ddgs  # DuckDuckGo search; install via: pip install duckduckgo-search
+from ddgs.exceptions import TimeoutException as SearchTimeout
 
 # Initialize colorama for cross-platform color support
 init(autoreset=True)
@@ -30,53 +39,141 @@ XAI_CLIENT = XAI(api_key=os.getenv("XAI_API_KEY"), base_url="https://api.x.ai/v1
 LLM_MODEL = "grok-code-fast-1"  # Default model
 MAX_RESPONSE_TOKENS = 20000
 N_RESPONSES = 1
-MESSAGES = [{"role": "system", "content": SYSTEM_PROMPT}]
-MESSAGES_TO_KEEP = 4  # Use even number for best results
+SYSTEM_MSG = MappingProxyType({"role": "system", "content": SYSTEM_PROMPT})  # Created once, never rebuilt
+MESSAGES = [SYSTEM_MSG]  # Append-only so the sent prefix stays byte-identical
+MESSAGES_TO_KEEP = 4  # Recent messages kept verbatim when compacting; use even number for best results
+COMPACT_THRESHOLD = 24000  # Characters of history that trigger summarizing older turns
+SUMMARY_MODEL = "grok-code-fast-1"  # Cheapest model, used only for history summaries
+SUMMARY_MAX_TOKENS = 200
 MAX_TOOL_ITERATIONS = 3  # Limit to prevent infinite loops (changed to 3)
+SEARCH_TIMEOUT = 10  # Seconds allowed per web search
+TOOL_RESULT_MAX_CHARS = 1500  # Tool results the model has already read are cut to this size
+SEARCH_BODY_CHARS = 300  # Snippet length sent back to the model; every char is re-sent on later calls
 CREATIVITY = 0.7  # Assuming a default value; was missing in original code
+# Only reuse responses when they are deterministic, or when explicitly requested via LLM_CACHE=1
+CACHE_RESPONSES = CREATIVITY == 0 or os.getenv("LLM_CACHE") == "1"
+RESPONSE_CACHE = diskcache.Cache('.llm_cache') if CACHE_RESPONSES else None
+# Instantiated once; get_code runs on every response
+_LEXER = PythonLexer()
+_FORMATTER = TerminalFormatter()
+# UI strings with the ANSI codes already baked in; only the model name varies
+_PROMPT_TEMPLATE = (
+    f"\n{Fore.YELLOW}Type '{Fore.GREEN}FIN{Fore.YELLOW}' to send, or to exit.\n"
+    f"{Fore.YELLOW}Type '{Fore.GREEN}CLEAR{Fore.YELLOW}' to clear history.\n"
+    f"{Fore.YELLOW}Type '{Fore.GREEN}MINI{Fore.YELLOW}' for grok-code-fast-1 or '{Fore.GREEN}FULL{Fore.YELLOW}' for grok-4-1-fast-non-reasoning-latest.\n"
+    f"{Fore.YELLOW}Current model: {Fore.GREEN}{{model}}{Fore.YELLOW}\n"
+    f"Enter your message:{Fore.CYAN}"
+)
+_SWITCHED_TEMPLATE = f"{Fore.YELLOW}Switched to {Fore.GREEN}{{model}}{Style.RESET_ALL}"
+_CMDS = frozenset({"CLEAR", "FIN", "MINI", "FULL"})
+_CODE_HEADER = f"{Fore.MAGENTA}code:\n{Style.RESET_ALL}"
+SEPARATOR_REFRESH_TURNS = 10  # Without SIGWINCH (Windows), re-measure the terminal every N turns
 
-def web_search(query: str) -> Dict[str, Any]:
-    """Perform a DuckDuckGo search with timeout and return structured results."""
-    results: List[Dict[str, Any]] = []
-    error_msg: str = None
-    success: bool = False
-    
-    def search_func():
-        nonlocal results, error_msg, success
-        try:
-            with ddgs.DDGS() as ddgs_client:
-                search_results = list(ddgs_client.text(query, max_results=5))  # Convert generator to list
-                if search_results:
-                    success = True
-                    results = search_results  # Store raw results
-                    logging.info(f"Search results for '{query}': {len(results)} items found")
-                    print(f"{Fore.GREEN}DuckDuckGo search found {len(results)} result(s).{Style.RESET_ALL}")
-                else:
-                    error_msg = "No results found for the query."
-        except Exception as e:
-            error_msg = f"Search error: {str(e)}"
-            logging.error(f"Error in web_search for '{query}': {str(e)}")
-    
-    thread = threading.Thread(target=search_func)
-    thread.start()
-    thread.join(timeout=10)  # 10-second timeout
-    
-    if thread.is_alive():
-        thread.join()  # Clean up
-        error_msg = f"Search timed out after 10 seconds for query: '{query}'"
+def _on_resize(*_args) -> None:
+    """Re-measure the terminal and rebuild the cached separator line."""
+    global _term_width, _separator
+    _term_width = shutil.get_terminal_size().columns
+    _separator = f"{Fore.MAGENTA}{'_' * _term_width}{Style.RESET_ALL}"
+
+_on_resize()
+if hasattr(signal, "SIGWINCH"):
+    signal.signal(signal.SIGWINCH, _on_resize)
+
+def web_search(query: str) -> str:
+    """Perform a DuckDuckGo search, bounded by the client's own timeout, and return JSON results or an ERROR line."""
+    try:
+        with ddgs.DDGS(timeout=SEARCH_TIMEOUT) as ddgs_client:
+            results = list(ddgs_client.text(query, max_results=5))  # Convert generator to list
+    except SearchTimeout:
+        error_msg = f"Search timed out after {SEARCH_TIMEOUT} seconds for query: '{query}'"
         logging.error(error_msg)
+        return f"ERROR: {error_msg}"
+    except Exception as e:
+        logging.error(f"Error in web_search for '{query}': {str(e)}")
+        return f"ERROR: Search error: {str(e)}"
+    
+    if not results:
+        return "ERROR: No results found for the query."
     
-    if success:
-        # Format results as a string for the LLM (e.g., JSON-like for easy parsing)
-        formatted_results = json.dumps([
-            {"title": r.get('title', 'No title'), "body": r.get('body', 'No description')} 
-            for r in results
-        ])
-        return {"success": True, "data": formatted_results}
-    else:
-        return {"success": False, "error": error_msg}
+    logging.info(f"Search results for '{query}': {len(results)} items found")
+    print(f"{Fore.GREEN}DuckDuckGo search found {len(results)} result(s).{Style.RESET_ALL}")
+    # Drop repeated URLs/titles and clip snippets to keep the tool message small
+    seen_urls, seen_titles = set(), set()
+    trimmed_results = []
+    for r in results:
+        title, url = r.get('title', 'No title'), r.get('href')
+        if title in seen_titles or (url and url in seen_urls):
+            continue
+        seen_titles.add(title)
+        seen_urls.add(url)
+        trimmed_results.append({"title": title, "body": r.get('body', 'No description')[:SEARCH_BODY_CHARS]})
+    # Format results as a string for the LLM (e.g., JSON-like for easy parsing)
+    return orjson.dumps(trimmed_results).decode()
+
+async def run_search(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one web_search tool call off the event loop and wrap the result as a tool message."""
+    args = orjson.loads(tool_call["function"]["arguments"])
+    print(f"\n{Fore.YELLOW}Searching DuckDuckGo for '{args['query']}'.{Style.RESET_ALL}")
+    search_result = await asyncio.to_thread(web_search, args['query'])
+    return {
+        "role": "tool",
+        "content": search_result,  # Already a JSON string; wrapping it again would escape every quote
+        "tool_call_id": tool_call["id"]
+    }
+
+def compact_tool_content(content: str) -> str:
+    """Keep only the head and tail of an oversized tool result."""
+    if len(content) <= TOOL_RESULT_MAX_CHARS:
+        return content
+    marker = " ...[truncated]... "
+    half = (TOOL_RESULT_MAX_CHARS - len(marker)) // 2  # Result fits the limit, so it is never re-cut
+    return f"{content[:half]}{marker}{content[-half:]}"
+
+async def run_searches(tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Run all web_search tool calls of one assistant turn concurrently."""
+    return await asyncio.gather(*[
+        run_search(tool_call) for tool_call in tool_calls
+        if tool_call["function"]["name"] == "web_search"
+    ])
+
+async def stream_completion(xai_client: XAI, **request: Any) -> tuple[str, List[Dict[str, Any]]]:
+    """Stream a chat completion, echoing content deltas and accumulating tool calls by index."""
+    buffer = io.StringIO()
+    tool_calls: Dict[int, Dict[str, Any]] = {}
+    stream = await xai_client.chat.completions.create(stream=True, **request)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            buffer.write(delta.content)
+            sys.stdout.write(f"{Fore.GREEN}{delta.content}{Style.RESET_ALL}")
+            sys.stdout.flush()
+        for tc in delta.tool_calls or []:
+            # Tool call ids/names arrive once; arguments arrive in fragments keyed by index
+            entry = tool_calls.setdefault(tc.index, {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""}
+            })
+            if tc.id:
+                entry["id"] = tc.id
+            if tc.function:
+                if tc.function.name:
+                    entry["function"]["name"] += tc.function.name
+                if tc.function.arguments:
+                    entry["function"]["arguments"] += tc.function.arguments
+    return buffer.getvalue(), [tool_calls[index] for index in sorted(tool_calls)]
+
+def response_cache_key(messages: List[Dict[str, Any]],
+                       llm_model: str,
+                       creativity: float,
+                       max_response_tokens: int) -> str:
+    """Hash everything that determines a completion into a stable cache key."""
+    payload = json.dumps(messages, sort_keys=True, default=dict) + llm_model + str(creativity) + str(max_response_tokens)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-def get_response(messages: List[Dict[str, Any]], 
+async def get_response(messages: List[Dict[str, Any]], 
                  xai_client: XAI, 
                  llm_model: str, 
                  max_response_tokens: int, 
@@ -98,58 +195,59 @@ def get_response(messages: List[Dict[str, Any]],
         }
     ]
     
-    current_messages = messages.copy()  # Work on a copy to avoid modifying original until final
+    cache_key = None
+    if RESPONSE_CACHE is not None:
+        cache_key = response_cache_key(messages, llm_model, creativity, max_response_tokens)
+        cached_content = RESPONSE_CACHE.get(cache_key)
+        if cached_content is not None:
+            logging.info(f"Response cache hit: {cache_key}")
+            print(f"{Fore.GREEN}{cached_content}{Style.RESET_ALL}")
+            return cached_content
     
-    while True:
+    current_messages = list(messages)  # Tool traffic stays local; the caller stores only the final answer
+    content = ""
+    
+    # One extra pass past the cap, with tools disabled, so the user always gets an answer
+    for iteration in range(MAX_TOOL_ITERATIONS + 1):
+        tool_choice = "auto"
+        if iteration == MAX_TOOL_ITERATIONS:
+            logging.warning(f"Tool iteration limit of {MAX_TOOL_ITERATIONS} reached; requesting a final answer")
+            tool_choice = "none"
         try:
-            response = xai_client.chat.completions.create(
+            content, tool_calls = await stream_completion(
+                xai_client,
                 model=llm_model,
                 messages=current_messages,
                 tools=tools,
-                tool_choice="auto",
+                tool_choice=tool_choice,
                 max_tokens=max_response_tokens,
                 n=n_responses,
                 stop=None,
                 temperature=creativity
             )
             
-            message = response.choices[0].message
-            
-            if not message.tool_calls:
+            if not tool_calls:
                 # No more tool calls, return the final content
-                return message.content or "No response content."
+                if cache_key is not None and content:
+                    RESPONSE_CACHE.set(cache_key, content)
+                return content or "No response content."
             
             # Append the assistant's message with tool_calls
             assistant_message = {
                 "role": "assistant",
-                "content": message.content,
-                "tool_calls": [
-                    {
-                        "id": tc.id,
-                        "type": tc.type,
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments
-                        }
-                    } for tc in message.tool_calls
-                ]
+                "content": content or None,
+                "tool_calls": tool_calls
             }
             current_messages.append(assistant_message)
             
+            # Results from earlier iterations were already read; shrink them before they are re-sent
+            current_messages[:] = [
+                {**m, "content": compact_tool_content(m["content"])} if m["role"] == "tool" else m
+                for m in current_messages
+            ]
+            
             # Handle all tool calls in parallel
-            for tool_call in message.tool_calls:
-                if tool_call.function.name == "web_search":
-                    args = json.loads(tool_call.function.arguments)
-                    print(f"{Fore.YELLOW}Searching DuckDuckGo for '{args['query']}'.{Style.RESET_ALL}")
-                    search_result = web_search(args['query'])  # Get structured results
-                    
-                    # Append the tool response
-                    tool_response = {
-                        "role": "tool",
-                        "content": json.dumps(search_result),  # Send as JSON string for LLM to parse
-                        "tool_call_id": tool_call.id
-                    }
-                    current_messages.append(tool_response)
+            current_messages.extend(await run_searches(tool_calls))
         
         except Exception as e:
             error_msg = (
@@ -160,97 +258,124 @@ def get_response(messages: List[Dict[str, Any]],
             logging.error(f"Exception in get_response: {str(e)}")
             print(error_msg)
             return f"\n{Fore.MAGENTA}Sorry, I couldn't process that request due to an error: {str(e)}{Style.RESET_ALL}"
+    
+    return content or "[tool iteration limit reached]"
+
+async def compact_history(messages: List[Dict[str, Any]], xai_client: XAI) -> List[Dict[str, Any]]:
+    """Condense all but the most recent messages into a single summary memo."""
+    older = messages[1:-MESSAGES_TO_KEEP]
+    if not older:
+        return messages
+    dialogue = "\n\n".join(f"{m['role']}: {m['content']}" for m in older)
+    try:
+        response = await xai_client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                messages[0],
+                {"role": "user", "content": f"Summarize this dialogue in 200 tokens or fewer:\n{dialogue}"}
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+        summary = response.choices[0].message.content or ""
+    except Exception as e:
+        # Fall back to plain truncation rather than letting the history grow unbounded
+        logging.error(f"Exception in compact_history: {str(e)}")
+        return [messages[0]] + messages[-MESSAGES_TO_KEEP:]
+    logging.info(f"Compacted {len(older)} message(s) into a summary")
+    return [messages[0], {"role": "system", "content": f"Prior summary:\n{summary}"}] + messages[-MESSAGES_TO_KEEP:]
 
 # The rest of the functions remain similar but with minor tweaks for consistency.
 
-def get_code(text: str) -> List[tuple[str, str]]:
-    """Extract and highlight Python code from text."""
-    pattern = r'`{3}\s*python\s*([\s\S]*?)\s*`{3}'
-    last_pos = 0
+@functools.lru_cache(maxsize=64)
+def get_code(text: str) -> tuple[tuple[str, str], ...]:
+    """Extract and highlight Python code from text in a single line-by-line pass."""
     output = []
-    for match in re.finditer(pattern, text):
-        before_text = text[last_pos:match.start()].strip()
-        if before_text:
-            output.append(("text", before_text))
-        code_content = match.group(1)
-        highlighted_code = highlight(code_content, PythonLexer(), TerminalFormatter())
-        output.append(("code", highlighted_code))
-        last_pos = match.end()
-    after_text = text[last_pos:].strip()
-    if after_text:
-        output.append(("text", after_text))
-    return output
+    block_lines: List[str] = []
+    in_code = False
+    
+    def flush():
+        block = "".join(block_lines)
+        block_lines.clear()
+        if in_code:
+            output.append(("code", highlight(block.rstrip(), _LEXER, _FORMATTER)))
+        elif block.strip():
+            output.append(("text", block.strip()))
+    
+    for line in text.splitlines(keepends=True):
+        fence = line.strip()
+        if not in_code and fence.startswith("```") and fence[3:].strip() == "python":
+            flush()
+            in_code = True
+        elif in_code and fence == "```":
+            flush()
+            in_code = False
+        else:
+            block_lines.append(line)
+    flush()  # An unterminated fence is still shown as code
+    return tuple(output)  # Immutable, since cached results are shared between callers
 
-def main_loop():
+async def main_loop():
     """Main interaction loop for user input and model responses."""
     global LLM_MODEL
+    turns = 0
     while True:
-        prompt_msg = (
-            f"\n{Fore.YELLOW}Type '{Fore.GREEN}FIN{Fore.YELLOW}' to send, or to exit.\n"
-            f"{Fore.YELLOW}Type '{Fore.GREEN}CLEAR{Fore.YELLOW}' to clear history.\n"
-            f"{Fore.YELLOW}Type '{Fore.GREEN}MINI{Fore.YELLOW}' for grok-code-fast-1 or '{Fore.GREEN}FULL{Fore.YELLOW}' for grok-4-1-fast-non-reasoning-latest.\n"
-            f"{Fore.YELLOW}Current model: {Fore.GREEN}{LLM_MODEL}{Fore.YELLOW}\n"
-            f"Enter your message:{Fore.CYAN}"
-        )
-        print(prompt_msg)
+        turns += 1
+        if not hasattr(signal, "SIGWINCH") and turns % SEPARATOR_REFRESH_TURNS == 0:
+            _on_resize()
+        print(_PROMPT_TEMPLATE.format(model=LLM_MODEL))
         
-        lines = []
+        prompt_buffer = io.StringIO()  # Pasted prompts can be hundreds of lines
         while True:
-            line = input()
-            if line.upper() == "CLEAR":
-                os.system('cls' if os.name == 'nt' else 'clear')
-                MESSAGES.clear()
-                MESSAGES.append({"role": "system", "content": SYSTEM_PROMPT})
-                logging.info(f"Message Log:\n{MESSAGES}")
-                break
-            elif line.upper() == "FIN":
-                break
-            elif line.upper() == "MINI":
-                LLM_MODEL = "grok-code-fast-1"
-                print(f"{Fore.YELLOW}Switched to {Fore.GREEN}{LLM_MODEL}{Style.RESET_ALL}")
-                break
-            elif line.upper() == "FULL":
-                LLM_MODEL = "grok-4-1-fast-non-reasoning-latest"
-                print(f"{Fore.YELLOW}Switched to {Fore.GREEN}{LLM_MODEL}{Style.RESET_ALL}")
+            raw_line = sys.stdin.readline()
+            line = raw_line.rstrip("\r\n") if raw_line else "FIN"  # Treat EOF like FIN
+            command = line.upper()  # Uppercased once per line
+            if command in _CMDS:
+                if command == "CLEAR":
+                    os.system('cls' if os.name == 'nt' else 'clear')
+                    MESSAGES[:] = [SYSTEM_MSG]  # Reuse the same system message object
+                    logging.info(f"Message Log:\n{MESSAGES}")
+                elif command == "MINI":
+                    LLM_MODEL = "grok-code-fast-1"
+                    print(_SWITCHED_TEMPLATE.format(model=LLM_MODEL))
+                elif command == "FULL":
+                    LLM_MODEL = "grok-4-1-fast-non-reasoning-latest"
+                    print(_SWITCHED_TEMPLATE.format(model=LLM_MODEL))
                 break
-            lines.append(line)
+            prompt_buffer.write(raw_line)
         
-        if not lines and line.upper() not in ["CLEAR", "MINI", "FULL"]:
+        if command == "FIN" and not prompt_buffer.tell():
             print(f"{Fore.YELLOW}No input provided. {Fore.MAGENTA}Exiting.{Style.RESET_ALL}\n")
             break
         
-        if line.upper() not in ["CLEAR", "MINI", "FULL"]:
-            text_prompt = "\n".join(lines)
+        if command == "FIN":
+            text_prompt = prompt_buffer.getvalue().removesuffix("\n")
             MESSAGES.append({"role": "user", "content": text_prompt})
             print(f"\n{Fore.YELLOW}Sending your message(s).{Style.RESET_ALL}\n")
             try:
-                llm_response = get_response(
+                llm_response = await get_response(
                     MESSAGES, XAI_CLIENT, LLM_MODEL, MAX_RESPONSE_TOKENS, N_RESPONSES, CREATIVITY
                 )
                 MESSAGES.append({"role": "assistant", "content": llm_response})
-                if len(MESSAGES) > MESSAGES_TO_KEEP:
-                    MESSAGES[:] = [MESSAGES[0]] + MESSAGES[-(MESSAGES_TO_KEEP - 1):]
+                # History stays append-only (stable prompt prefix) until it is worth summarizing
+                if sum(len(m['content']) for m in MESSAGES) > COMPACT_THRESHOLD:
+                    MESSAGES[:] = await compact_history(MESSAGES, XAI_CLIENT)
                 
-                # Process and display the response
-                blocks = get_code(llm_response)
-                terminal_width = os.get_terminal_size().columns
-                separator = f"{Fore.MAGENTA}{'_' * terminal_width}{Style.RESET_ALL}"
-                print(separator)
-                for content_type, content in blocks:
-                    if content_type == "text":
-                        # Check for search results and highlight them
-                        if "search results" in content.lower():
-                            print(f"{Fore.MAGENTA}{content_type} (Search Results):{Style.RESET_ALL}\n{Fore.GREEN}{content}{Style.RESET_ALL}")
-                        else:
-                            print(f"{Fore.MAGENTA}{content_type}:{Style.RESET_ALL}\n{Fore.GREEN}{content}{Style.RESET_ALL}")
-                    elif content_type == "code":
-                        print(f"{Fore.MAGENTA}{content_type}:\n{Style.RESET_ALL}{content}{Style.RESET_ALL}")
-                print(separator)
+                # Text was streamed as it arrived; re-display only the highlighted code blocks
+                frame = io.StringIO()
+                frame.write("\n")
+                blocks = [block for block in get_code(llm_response) if block[0] == "code"]
+                if blocks:
+                    frame.write(f"{_separator}\n")
+                    for _, content in blocks:
+                        frame.write(f"{_CODE_HEADER}{content}{Style.RESET_ALL}\n")
+                    frame.write(f"{_separator}\n")
+                sys.stdout.write(frame.getvalue())  # One write for the whole frame
+                sys.stdout.flush()
             except Exception as e:
                 print(f"{Fore.YELLOW}Oops, something went wrong: {Fore.RED}{e}{Style.RESET_ALL}")
                 logging.error(f"Exception in main_loop: {str(e)}")
 
 if __name__ == "__main__":
-    main_loop()
+    asyncio.run(main_loop())  # One event loop for the whole session keeps the async client's connections reusable
 
 grok
\ No newline at end of file